@@ -7,11 +7,8 @@ Author(s):
 Licensed under the MIT License. Copyright University of Pennsylvania 2024.
 """
 import argparse
-import json
-import logging
 from math import isclose
 from pathlib import Path
-from typing import Any, Dict, Optional, Union
 
 
 # Correct answer to parts (3) and (4) of HW 2.
@@ -34,10 +31,14 @@ CORRECT_ANSWER = {
 }
 
 
+# Keys to grade, in order.
+CORRECT_ANSWER_KEYS = tuple(CORRECT_ANSWER)
+
+
 def grade(
-    study_info: Dict[str, Any],
+    study_info: dict,
     key: str,
-    reference_correct_answer: Dict[str, Any],
+    reference_correct_answer: dict,
     case_sensitive: bool = False
 ) -> int:
     """
@@ -52,52 +53,72 @@ def grade(
             assessing if a student answer is correct. Default False.
     Returns:
         One of the following integer exit codes:
-            0: correct answer.
+            0: correct answer, or the reference answer is None (i.e., any
+                student answer is accepted).
             1: incorrect answer.
             2: only student answer does not contain the input key.
             3: only instructor answer does not contain the input key.
             4: both student and instructor answer does not contain the input
                 key.
     """
-    if key not in study_info.keys() and (
-        key not in reference_correct_answer.keys()
-    ):
+    if key not in study_info and key not in reference_correct_answer:
         return 4
-    elif key not in reference_correct_answer.keys():
+    elif key not in reference_correct_answer:
         return 3
-    elif key not in study_info.keys():
+    elif key not in study_info:
         return 2
-    if isinstance(reference_correct_answer[key], float):
-        return 1 - int(isclose(study_info[key], reference_correct_answer[key]))
-    elif isinstance(reference_correct_answer[key], int):
-        return 1 - int(study_info[key] == reference_correct_answer[key])
-    student_answer = str(study_info[key])
-    correct_answer = str(reference_correct_answer[key])
-    if not case_sensitive:
-        student_answer = student_answer.lower()
-        correct_answer = correct_answer.lower()
-    return 1 - int(student_answer == correct_answer)
+    correct_answer = reference_correct_answer[key]
+    if correct_answer is None:
+        return 0
+    student_answer = study_info[key]
+    if isinstance(correct_answer, float):
+        return 1 - int(isclose(student_answer, correct_answer))
+    elif isinstance(correct_answer, int):
+        return 1 - int(student_answer == correct_answer)
+    if not isinstance(student_answer, str):
+        student_answer = str(student_answer)
+    if case_sensitive:
+        return int(student_answer != str(correct_answer))
+    return int(
+        student_answer.casefold() != str(correct_answer).casefold()
+    )
 
 
 def read(
-    student_answer_path: Union[Path, str]
-) -> Optional[Dict[str, Any]]:
+    student_answer_path: Path | str
+) -> dict | None:
     """
     Reads a student's answer output JSON file.
     Input:
         student_answer_path: file path to the student's answer file.
     Returns:
-        The student's answers as a JSON object. If the specified path is not
-        a valid JSON file, then None is returned.
+        The student's answers as a JSON object. If the specified path does
+        not exist or is not a valid JSON file, then None is returned.
     """
-    with open(student_answer_path, "r") as f:
-        student_answer = json.load(f)
     try:
-        with open(student_answer_path, "r") as f:
-            student_answer = json.load(f)
+        buf = Path(student_answer_path).read_bytes()
+    except OSError:
+        return None
+
+    try:
+        import orjson
+    except ImportError:
+        orjson = None
+
+    if orjson is not None:
+        try:
+            return orjson.loads(buf)
+        except orjson.JSONDecodeError:
+            # orjson rejects NaN and Infinity, which the stdlib json module
+            # accepts (and writes by default), so fall through to it.
+            pass
+
+    import json
+
+    try:
+        return json.loads(buf)
     except ValueError:
         return None
-    return student_answer
 
 
 def build_args() -> argparse.Namespace:
@@ -119,19 +140,21 @@ def build_args() -> argparse.Namespace:
     return parser.parse_args()
 
 
-def main(student_answer_path: Union[Path, str]) -> int:
+def main(student_answer_path: Path | str) -> int:
+    import logging
+
     # Read in the student's answer.
     student_answers = read(student_answer_path)
     if student_answers is None:
         logging.debug(f"{student_answer_path} is not a valid JSON file.")
         return 0
 
-    # Grade the student's responses:
+    # Grade the student's responses. Global lookups are hoisted out of the
+    # loop and the arguments to grade() are passed positionally.
+    grade_fn, reference = grade, CORRECT_ANSWER
     num_points = 0
-    for key in CORRECT_ANSWER.keys():
-        exit_code = grade(
-            student_answers, key, CORRECT_ANSWER, case_sensitive=False
-        )
+    for key in CORRECT_ANSWER_KEYS:
+        exit_code = grade_fn(student_answers, key, reference, False)
         if exit_code == 0:
             num_points += 1
         else:
@@ -8,10 +8,20 @@ Licensed under the MIT License. Copyright University of Pennsylvania 2024.
 """
 import json
 import logging
-import pyorthanc
-from datetime import date, datetime
+from dataclasses import asdict, dataclass
+from math import isfinite
 from pathlib import Path
-from typing import Any, Dict, NamedTuple, Optional, Tuple, Union
+from typing import TYPE_CHECKING, Any, Dict, Optional, Tuple, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if TYPE_CHECKING:
+    import numpy as np
+    import pyorthanc
+    from datetime import date
 
 
 # Student Penn ID.
@@ -22,7 +32,8 @@ PENN_ID: int = 12345678
 SAVEPATH: Union[Path, str] = "study_info.json"
 
 
-class InstanceInfo(NamedTuple):
+@dataclass(frozen=True, slots=True)
+class InstanceInfo:
     Age: str
     Sex: str
     StudyDescription: Optional[str]
@@ -33,12 +44,12 @@ class InstanceInfo(NamedTuple):
     StudyInstanceUID: str
     NumRows: int
     NumCols: int
-    MinPixelVal: float
-    MaxPixelVal: float
-    MeanPixelVal: float
+    MinPixelVal: Optional[float]
+    MaxPixelVal: Optional[float]
+    MeanPixelVal: Optional[float]
 
 
-def calculate_age(birth_date: datetime) -> int:
+def calculate_age(birth_date: "date") -> int:
     """
     Calculates the current age (in years) of a patient given their birthday.
     Input:
@@ -46,23 +57,68 @@ def calculate_age(birth_date: datetime) -> int:
     Returns:
         The current age (in years) of the patient.
     """
+    from datetime import date
+
     today = date.today()
-    return today.year - birth_date.year - (
-        (today.month, today.day) < (birth_date.month, birth_date.day)
+    # Pack (month, day) into a single integer since days are at most 31.
+    return today.year - birth_date.year - int(
+        today.month * 32 + today.day < birth_date.month * 32 + birth_date.day
     )
 
 
+def read_pixel_array(
+    client: "pyorthanc.Orthanc", instance: "pyorthanc.Instance"
+) -> "np.ndarray":
+    """
+    Reads the decoded pixel data of an Orthanc instance. The pixel data is
+    decoded server-side using Orthanc's numpy endpoint, falling back to
+    decoding the DICOM file with pydicom for older Orthanc versions that do
+    not provide the endpoint or if Orthanc does not return stored integer
+    values.
+    Input:
+        client: an Orthanc client to retrieve the pixel data from.
+        instance: an Instance object to read.
+    Returns:
+        The pixel array of the instance with the same layout as pydicom.
+    """
+    import numpy as np
+    from io import BytesIO
+
+    # Request the route through the underlying httpx client, since pyorthanc
+    # does not expose the status code of failed requests.
+    response = client.get(
+        f"{client.url}/instances/{instance.id_}/numpy",
+        params={"compress": False, "rescale": False}
+    )
+    if response.status_code == 404:
+        return instance.get_pydicom().pixel_array
+    response.raise_for_status()
+
+    # Orthanc returns a (frame, height, width, channel) array.
+    image_data = np.load(BytesIO(response.content))
+    if image_data.shape[-1] == 1:
+        image_data = image_data[..., 0]
+    if image_data.shape[0] == 1:
+        image_data = image_data[0]
+    # Stored pixel values are integers; anything else would not match the
+    # raw values returned by pydicom.
+    if not np.issubdtype(image_data.dtype, np.integer):
+        return instance.get_pydicom().pixel_array
+    return image_data
+
+
 def get_instance_info(
-    client: pyorthanc.Orthanc,
+    client: "pyorthanc.Orthanc",
     patient_id: str,
     series_number: int,
-    instance_number: int
+    instance_number: int,
+    need_pixels: bool = True
 ) -> Tuple[
     Optional[InstanceInfo],
-    Optional[pyorthanc.Patient],
-    Optional[pyorthanc.Study],
-    Optional[pyorthanc.Series],
-    Optional[pyorthanc.Instance],
+    Optional["pyorthanc.Patient"],
+    Optional["pyorthanc.Study"],
+    Optional["pyorthanc.Series"],
+    Optional["pyorthanc.Instance"],
 ]:
     """
     Retrieves the information about a patient study instance.
@@ -71,14 +127,19 @@ def get_instance_info(
         patient_id: the patient ID to query by.
         series_number: the index of the series in the study to retrieve.
         instance_number: the index of the instance in the study to retrieve.
+        need_pixels: whether to decode the pixel data to compute the pixel
+            statistics. If False, the pixel statistics are None. Default True.
     Returns:
         instance_info: an InstanceInfo object. Returns None if no patient was
-            found.
+            found. All five return values are also None if the requested
+            series or instance number does not exist.
         patient: a Patient object. Returns None if no patient was found.
         study: a Study object. Returns None if no patient was found.
         series: a Series object. Returns None if no patient was found.
         instance: an Instance object. Returns None if no patient was found.
     """
+    import pyorthanc
+
     query_results = pyorthanc.find_patients(client, {"PatientID": patient_id})
     if len(query_results) == 0:
         return None, None, None, None, None
@@ -92,25 +153,54 @@ def get_instance_info(
     if "StudyDescription" in study_info.keys():
         desc = study_info["StudyDescription"]
 
+    series_list = list(study.series)
     series = next(
-        filter(lambda x: x.series_number == series_number, study.series)
+        (s for s in series_list if s.series_number == series_number), None
     )
+    if series is None:
+        return None, None, None, None, None
     series_info = series.main_dicom_tags
 
     instance = next(
-        filter(
-            lambda x: x.instance_number == instance_number, series.instances
-        )
+        (
+            i for i in series.instances
+            if i.instance_number == instance_number
+        ),
+        None
     )
+    if instance is None:
+        return None, None, None, None, None
     try:
         age = calculate_age(patient.birth_date)
     except AttributeError:
         age = instance.tags["0010,1010"]["Value"]
 
-    image_data = instance.get_pydicom().pixel_array
-    num_rows, num_cols = image_data.shape
-    min_pixel_val, max_pixel_val = image_data.min(), image_data.max()
-    mean_pixel_val = image_data.mean()
+    min_pixel_val = max_pixel_val = mean_pixel_val = None
+    if need_pixels:
+        import numpy as np
+
+        image_data = read_pixel_array(client, instance)
+        if image_data.ndim != 2 and not (
+            image_data.ndim == 3 and image_data.shape[-1] == 3
+        ):
+            raise ValueError(
+                f"Expected a single-frame image, got shape {image_data.shape}"
+            )
+        num_rows, num_cols = image_data.shape[:2]
+        flat = np.ascontiguousarray(image_data).ravel()
+        min_pixel_val = float(flat.min())
+        max_pixel_val = float(flat.max())
+        if np.issubdtype(flat.dtype, np.integer):
+            # Accumulate in int64 to avoid a float64 copy of the image.
+            mean_pixel_val = int(flat.sum(dtype=np.int64)) / flat.size
+        else:
+            mean_pixel_val = float(flat.mean(dtype=np.float64))
+    else:
+        # Read the image dimensions from the instance tags instead of
+        # downloading the DICOM file.
+        tags = instance.tags
+        num_rows = tags["0028,0010"]["Value"]
+        num_cols = tags["0028,0011"]["Value"]
 
     instance_info = InstanceInfo(**{
         "Age": str(age),
@@ -119,13 +209,13 @@ def get_instance_info(
         "Modality": series_info["Modality"],
         "Manufacturer": series_info["Manufacturer"],
         "PatientID": patient_info["PatientID"],
-        "NumSeries": len(study.series),
+        "NumSeries": len(series_list),
         "StudyInstanceUID": study_info["StudyInstanceUID"],
         "NumRows": int(num_rows),
         "NumCols": int(num_cols),
-        "MinPixelVal": float(min_pixel_val),
-        "MaxPixelVal": float(max_pixel_val),
-        "MeanPixelVal": float(mean_pixel_val),
+        "MinPixelVal": min_pixel_val,
+        "MaxPixelVal": max_pixel_val,
+        "MeanPixelVal": mean_pixel_val,
     })
     return instance_info, patient, study, series, instance
 
@@ -142,16 +232,26 @@ def save_instance_info(
     Returns:
         None.
     """
-    with open(savepath, "w") as f:
-        json.dump(instance_info, f, indent=indent)
-    logging.info(f"Saved instance info to {savepath}")
+    # orjson writes NaN and Infinity as null, so only use it when the
+    # output would match the stdlib json module.
+    if orjson is not None and indent == 2 and all(
+        isfinite(val) for val in instance_info.values()
+        if isinstance(val, float)
+    ):
+        with open(savepath, "wb") as f:
+            f.write(orjson.dumps(instance_info, option=orjson.OPT_INDENT_2))
+    else:
+        with open(savepath, "w") as f:
+            json.dump(instance_info, f, indent=indent)
+    if logging.getLogger().isEnabledFor(logging.INFO):
+        logging.info(f"Saved instance info to {savepath}")
     return
 
 
 def modify_instance_info(
-    patient: Optional[pyorthanc.Patient] = None,
-    study: Optional[pyorthanc.Study] = None,
-    series: Optional[pyorthanc.Series] = None,
+    patient: Optional["pyorthanc.Patient"] = None,
+    study: Optional["pyorthanc.Study"] = None,
+    series: Optional["pyorthanc.Series"] = None,
     patient_replace: Dict[str, Any] = {},
     study_replace: Dict[str, Any] = {},
     series_replace: Dict[str, Any] = {},
@@ -200,58 +300,70 @@ def main(
     """
     assert 10000000 <= penn_id <= 99999999, "Must provide valid Penn ID"
 
+    import httpx
+    import pyorthanc
+
+    # Reuse keep-alive connections across the sequential REST requests, and
+    # close the connection pool once all of the requests are done.
     client = pyorthanc.Orthanc(
         orthanc_url,
         username=username,
-        password=password
-    )
-
-    # Retrieve the requested information about the existing study, and
-    # answer the questions about the imaging study.
-    instance_info, patient, study, series, _ = get_instance_info(
-        client,
-        "A034518",
-        series_number=4,
-        instance_number=130
+        password=password,
+        timeout=30.0,
+        limits=httpx.Limits(
+            max_keepalive_connections=8,
+            max_connections=8,
+            keepalive_expiry=60.0
+        )
     )
-    assert instance_info is not None, "Patient {patient_id} query failed"
+    with client:
+        # Retrieve the requested information about the existing study, and
+        # answer the questions about the imaging study.
+        instance_info, patient, study, series, _ = get_instance_info(
+            client,
+            "A034518",
+            series_number=4,
+            instance_number=130
+        )
+        assert instance_info is not None, "Patient {patient_id} query failed"
 
-    if savepath is not None:
-        save_instance_info(instance_info._asdict(), savepath, **kwargs)
+        if savepath is not None:
+            save_instance_info(asdict(instance_info), savepath, **kwargs)
 
-    instance_info, patient, study, series, _ = get_instance_info(
-        client,
-        "3142537564",
-        series_number=-1,
-        instance_number=1
-    )
-    assert instance_info is not None, "Patient {patient_id} query failed"
-    # Modify the study.
-    new_instance_uid = instance_info.StudyInstanceUID[:len(str(penn_id))] + (
-        str(penn_id)
-    )
-    modify_instance_info(
-        patient=patient,
-        study=study,
-        series=series,
-        patient_replace={"PatientSex": "O", "PatientID": "8675309"},
-        study_replace={
-            "AccessionNumber": f"EAS5850-{penn_id}",
-            "StudyInstanceUID": new_instance_uid,
-            "StudyDate": "20221231",
-            "ReferringPhysicianName": "Doctor^Spock"
-        },
-        series_replace={},
-        force=True,
-        keep_source=keep_source
-    )
+        instance_info, patient, study, series, _ = get_instance_info(
+            client,
+            "3142537564",
+            series_number=-1,
+            instance_number=1,
+            need_pixels=False
+        )
+        assert instance_info is not None, "Patient {patient_id} query failed"
+        # Modify the study.
+        uid = instance_info.StudyInstanceUID
+        new_instance_uid = uid[:len(str(penn_id))] + str(penn_id)
+        modify_instance_info(
+            patient=patient,
+            study=study,
+            series=series,
+            patient_replace={"PatientSex": "O", "PatientID": "8675309"},
+            study_replace={
+                "AccessionNumber": f"EAS5850-{penn_id}",
+                "StudyInstanceUID": new_instance_uid,
+                "StudyDate": "20221231",
+                "ReferringPhysicianName": "Doctor^Spock"
+            },
+            series_replace={},
+            force=True,
+            keep_source=keep_source
+        )
     logging.info("Done!")
 
 
 if __name__ == "__main__":
-    logging.basicConfig(
-        level=logging.INFO,
-        format="%(asctime)s [%(levelname)s] %(message)s",
-        handlers=[logging.StreamHandler()]
-    )
+    if not logging.getLogger().handlers:
+        logging.basicConfig(
+            level=logging.INFO,
+            format="%(asctime)s [%(levelname)s] %(message)s",
+            handlers=[logging.StreamHandler()]
+        )
     main(PENN_ID, savepath=SAVEPATH)